@@ -4,10 +4,14 @@
 #include <util/delay.h>
 
 #define F_CPU 16000000UL
-#define BAUD_RATE 9600
+#define BAUD_RATE 115200
 #define MAX_CSV_LENGTH 256
 #define MAX_DEVICES 8
 
+// Binary protocol framing: 0xAA <count> (<device-id> <state>)* 0x55
+#define BIN_FRAME_START 0xAA
+#define BIN_FRAME_END   0x55
+
 // Precise Pin Definitions (Double-check with your actual hardware)
 #define ROOM1_LIGHT_PIN PD7   // Pin 7
 #define ROOM2_LIGHT_PIN PB2   // Pin 10
@@ -62,16 +66,25 @@ void update_device_state(const char* device, const char* action) {
             // Direct port manipulation with pointer
             if (new_state) {
                 *(deviceStates[i].port) |= (1 << deviceStates[i].pin);
-                UART_transmit_string(action);  // Debug message
             } else {
                 *(deviceStates[i].port) &= ~(1 << deviceStates[i].pin);
-                UART_transmit_string(action);  // Debug message
             }
             break;
         }
     }
 }
 
+// Binary protocol: device ids follow the deviceStates[] table order,
+// matching the host's enumeration of the device dictionary
+void update_device_by_id(uint8_t id, uint8_t state) {
+    if (id >= NUM_DEVICES) return;
+    if (state) {
+        *(deviceStates[id].port) |= (1 << deviceStates[id].pin);
+    } else {
+        *(deviceStates[id].port) &= ~(1 << deviceStates[id].pin);
+    }
+}
+
 // Parse entire CSV state
 void parse_csv_data(char* csv_string) {
     char* token;
@@ -101,10 +114,13 @@ void parse_csv_data(char* csv_string) {
     }
 }
 
-// UART Initialization (same as previous implementation)
+// UART Initialization
 void UART_init(unsigned int ubrr) {
     UBRR0H = (unsigned char)(ubrr>>8);
     UBRR0L = (unsigned char)ubrr;
+    // Double-speed mode keeps the baud error ~2% at 115200 with a 16 MHz
+    // clock (plain mode lands at 125000, an 8.5% error)
+    UCSR0A = (1<<U2X0);
     UCSR0B = (1<<RXEN0)|(1<<TXEN0);
     UCSR0C = (1<<USBS0)|(3<<UCSZ00);
 }
@@ -132,8 +148,8 @@ int main(void) {
     // Initialize pins
     init_pins();
 
-    // Initialize UART
-    UART_init(F_CPU/16/BAUD_RATE - 1);
+    // Initialize UART (double-speed mode: divisor is F_CPU/8)
+    UART_init(F_CPU/8/BAUD_RATE - 1);
 
     // Global variables for CSV parsing
     volatile char csv_buffer[MAX_CSV_LENGTH];
@@ -141,9 +157,22 @@ int main(void) {
 
     while (1) {
         char received_char = UART_receive();
-        
+
+        // Binary frame: 0xAA <count> (<id> <state>)* 0x55
+        if ((uint8_t)received_char == BIN_FRAME_START) {
+            uint8_t count = UART_receive();
+            // Consume every pair; update_device_by_id drops bad ids
+            for (uint8_t i = 0; i < count; i++) {
+                uint8_t id = UART_receive();
+                uint8_t state = UART_receive();
+                update_device_by_id(id, state);
+            }
+            if ((uint8_t)UART_receive() == BIN_FRAME_END) {
+                UART_transmit_string("ALL_OK");
+            }
+        }
         // Look for start of CSV
-        if (received_char == 'S' && 
+        else if (received_char == 'S' &&
             UART_receive() == 'T' && 
             UART_receive() == 'A' && 
             UART_receive() == 'R' && 
@@ -165,10 +194,10 @@ int main(void) {
                     
                     // Parse and process CSV
                     parse_csv_data((char*)csv_buffer);
-                    
-                    // Send acknowledgment
-                    UART_transmit_string("CMD_OK");
-                    
+
+                    // Single summary acknowledgment for the whole batch
+                    UART_transmit_string("ALL_OK");
+
                     break;
                 }
                 
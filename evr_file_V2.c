@@ -103,8 +103,6 @@ void update_device_state(const char* device, const char* action, const char* val
                     }
                     break;
             }
-            // Send acknowledgment
-            UART_transmit_string("OK");
             return;
         }
     }
@@ -207,7 +205,8 @@ int main(void) {
                     
                     csv_buffer[buffer_index] = '\0';
                     parse_csv_data((char*)csv_buffer);
-                    UART_transmit_string("CMD_OK");
+                    // Single summary acknowledgment for the whole batch
+                    UART_transmit_string("ALL_OK");
                     break;
                 }
                 
@@ -1,13 +1,51 @@
-from langchain_community.vectorstores import FAISS
 from langchain.llms.base import LLM
 from groq import Groq
 from typing import Any, List, Optional, Dict
 from pydantic import Field, BaseModel
-import os
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from langchain_community.llms import Ollama
+import threading
+import httpx
+
+_clients: Dict[str, Groq] = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_groq_client(api_key: str) -> Groq:
+    """One Groq client (and TCP connection pool) per API key per process.
+
+    The HTTP/2 keep-alive transport lets back-to-back and concurrent calls
+    multiplex over one TLS session instead of paying a fresh TCP+TLS
+    handshake (~100-300 ms) after idle periods.
+    """
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = Groq(
+                api_key=api_key,
+                http_client=httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_keepalive_connections=8),
+                    # Bound the upstream wait: a hung Groq call would
+                    # otherwise pin a serving thread indefinitely and
+                    # drain the worker pool
+                    timeout=httpx.Timeout(15.0, connect=5.0),
+                ),
+            )
+        return client
+
+
+def close_shared_clients():
+    """Close every cached Groq client's connection pool.
+
+    Process-wide teardown for shutdown paths; the next call to
+    get_shared_client after this opens a fresh pool.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
 
 
 class GroqLLM(LLM, BaseModel):
@@ -17,13 +55,23 @@ class GroqLLM(LLM, BaseModel):
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.client = Groq(api_key=self.groq_api_key)
+        self.client = self.get_shared_client(self.groq_api_key)
+
+    @staticmethod
+    def get_shared_client(api_key: str) -> Groq:
+        """Return the process-wide Groq client for this API key"""
+        return _shared_groq_client(api_key)
     
     @property
     def _llm_type(self) -> str:
         return "groq"
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              response_format: Optional[Dict[str, str]] = None, **kwargs: Any) -> str:
+        if response_format is not None:
+            # e.g. {"type": "json_object"} to enable Groq's JSON mode, which
+            # guarantees a syntactically valid JSON reply server-side
+            kwargs["response_format"] = response_format
         completion = self.client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model=self.model_name,
@@ -31,6 +79,22 @@ class GroqLLM(LLM, BaseModel):
         )
         return completion.choices[0].message.content
     
+    def _stream(self, prompt: str, response_format: Optional[Dict[str, str]] = None,
+                **kwargs: Any):
+        """Yield completion deltas as they arrive from Groq"""
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+        completion = self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model_name,
+            stream=True,
+            **kwargs
+        )
+        for chunk in completion:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
     @property
     def _identifying_params(self) -> Dict[str, Any]:
         """Get the identifying parameters."""
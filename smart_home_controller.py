@@ -0,0 +1,1091 @@
+import collections
+import copy
+import hashlib
+import logging
+import os
+import fastjsonschema
+try:
+    import orjson as _json  # 2-5x faster C parser
+except ImportError:
+    import json as _json  # same loads() signature for str input
+from flask import Flask, request, jsonify
+from typing import Dict, Any
+from groq_client import GroqLLM, close_shared_clients
+import serial
+import queue
+import re
+import sched
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from prompt_template import template_3, template_5
+
+# Optional semantic cache: a local sentence embedder matches paraphrased
+# commands to cached parses. Heavyweight (~80 MB model), so it is both
+# an optional dependency and opt-in via SEMANTIC_CACHE=1.
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+log = logging.getLogger(__name__)
+
+# Sentinel so a device never sent before always counts as changed
+_UNSENT = object()
+
+# Text-protocol frame markers, encoded once at import
+_FRAME_START = b"START"
+_FRAME_END = b"END\n"
+
+# Per-app device tables and prompts. Both app versions share one controller
+# (and therefore one Groq client and one serial port) instead of duplicating
+# the whole class; the schema flag selects the device set and template.
+_SCHEMAS = {
+    "basic": {
+        "device_states": {
+            # Lights
+            "room 1 light": "off",
+            "room 2 light": "off",
+            "room 3 light": "off",
+            "kitchen light": "off",
+
+            # Fans
+            "room 1 fan": "off",
+            "room 2 fan": "off",
+            "room 3 fan": "off",
+            "kitchen fan": "off"
+        },
+        "template": template_3,
+        "format_instructions": (
+            "Return a JSON object with keys: "
+            "device_states (dictionary of affected device names to 'on'/'off'), "
+            "chatbot_message (friendly message describing the actions taken), "
+            "delay_seconds (delay in seconds before executing, 0 if not specified)."
+        ),
+    },
+    "intensity": {
+        "device_states": {
+            # Lights with ON/OFF and Intensity Control
+            "room 1 light": "off",
+            "room 2 light": {"state": "off", "intensity": 0},  # Intensity control (0-100%)
+            "room 3 light": {"state": "off", "intensity": 0},  # Intensity control (0-100%)
+            "room 4 light": "off",
+            "kitchen light": "off",
+
+            # TV and Refrigerator (ON/OFF)
+            "TV": "off",
+            "Refrigerator": "off",
+
+            # DC Motor (ON/OFF)
+            "DC motor": "off",
+
+            # Servo Motor (Clockwise/Anticlockwise in degrees)
+            "Servo motor": {"direction": "none", "degrees": 0}
+        },
+        "template": template_5,
+        "format_instructions": (
+            "Return a JSON object with keys: "
+            "device_states (dictionary of affected device names to their states), "
+            "light_intensity (dictionary of lights to integer intensity 0-100, "
+            "no percent sign, only 'room 2 light' and 'room 3 light'), "
+            "servo_motor_angle (integer angle 0-180, no degree sign), "
+            "servo_motor_direction (one of 'clock', 'anti', 'none'), "
+            "chatbot_message (friendly message describing the actions taken), "
+            "delay_seconds (integer delay in seconds before executing, 0 if not specified)."
+        ),
+    },
+}
+
+
+class SmartHomeController:
+    def __init__(self,
+                 schema="intensity",
+                 serial_port='COM5',
+                 baud_rate=9600,
+                 groq_api_key="your groq api key here",
+                 binary_protocol=False):
+        """
+        Initialize Smart Home Controller with serial and LLM components.
+
+        schema selects the device set and prompt: "basic" for the on/off
+        lights-and-fans app, "intensity" for the app with dimmable lights
+        and the servo motor.
+
+        binary_protocol switches on/off updates from text rows to 2-byte
+        (device-id, state) pairs - ~12x less UART traffic - and requires
+        firmware that parses the 0xAA-framed format. Devices with
+        structured values still go out as text rows.
+        """
+        if schema not in _SCHEMAS:
+            raise ValueError(f"Unknown schema: {schema!r} (expected one of {sorted(_SCHEMAS)})")
+        self.schema = schema
+        config = _SCHEMAS[schema]
+
+        # Deep copy so two controllers never share mutable state
+        self.device_states = copy.deepcopy(config["device_states"])
+
+        # Devices with structured values get dedicated handling below
+        self._intensity_lights = [
+            dev for dev, state in self.device_states.items()
+            if isinstance(state, dict) and "intensity" in state
+        ]
+        self._has_servo = "Servo motor" in self.device_states
+
+        # Fixed send order, computed once; the send loop iterates this
+        # tuple instead of allocating a dict view per call
+        self._device_names = tuple(self.device_states)
+
+        # Cache of encoded serial rows per device; only devices marked dirty
+        # are re-encoded on the next send. Everything starts dirty so the
+        # first send transmits the full state.
+        self._encoded_cache = {}
+        self._dirty = set(self.device_states)
+
+        # Device ids for the binary protocol follow declaration order,
+        # which must match the firmware's device table
+        self._binary_protocol = binary_protocol
+        self._dev_ids = {name: i for i, name in enumerate(self.device_states)}
+
+        # What the microcontroller last acknowledged, per device. Rows whose
+        # value matches this are skipped even if marked dirty (e.g. a toggle
+        # on and back off within one batch window), and a failed write keeps
+        # it stale so the changes are retransmitted on the next send.
+        self._last_sent = {}
+
+        # The device table is fixed at startup, so the per-row type dispatch
+        # in the send path can be compiled away into one straight f-string
+        # per device
+        self._build_row_encoders()
+
+        # Serial Communication Setup. The port stays open for the lifetime
+        # of the controller: every reopen toggles DTR and resets the
+        # microcontroller, costing ~2 s. The one-time reset wait happens in
+        # the background so init returns immediately.
+        self._serial_port = serial_port
+        self._baud_rate = baud_rate
+        self._ser_ready = threading.Event()
+        try:
+            self._open_serial()
+            log.info("Connected to serial port: %s", serial_port)
+            threading.Thread(target=self._wait_for_reset, daemon=True).start()
+        except serial.SerialException as e:
+            log.error("Error connecting to serial port: %s", e)
+            self.ser = None
+            self._ser_ready.set()
+
+        # The Groq client (and its TCP connection pool) is shared per API
+        # key across every controller in the process
+        self.llm = GroqLLM(
+            groq_api_key=groq_api_key,
+            model_name="llama-3.3-70b-versatile"
+        )
+
+        # Short device keys shrink the prompt: a one-line legend plus keys
+        # like "r1l" costs far fewer tokens per call than spelling out
+        # every full device name. Unknown keys pass through untouched, so
+        # replies using full names still work.
+        self._key_map = {}
+        for name in self.device_states:
+            short = "".join(w if w.isdigit() else w[0].lower() for w in name.split())
+            if short in self._key_map:
+                short = name  # collision: keep the full name
+            self._key_map[short] = name
+        legend = ", ".join(f"{short}={name}" for short, name in self._key_map.items())
+
+        # Groq's JSON mode guarantees a syntactically valid JSON object
+        # server-side, so a terse description of the expected keys replaces
+        # the verbose LangChain format-instructions block
+        self._format_instructions = config["format_instructions"] + (
+            " Use these short device keys for device_states and light_intensity: "
+            f"{legend}."
+            # delay_seconds first lets the streaming path decide whether an
+            # early serial dispatch is safe before device_states arrives
+            " Emit delay_seconds as the first key of the JSON object."
+        )
+        self._prompt_prefix = config["template"].replace(
+            "{format_instructions}", self._format_instructions
+        )
+        # Split once around the command slot so per-request prompt assembly
+        # is one concatenation instead of replace() re-scanning the whole
+        # ~1.5 KB template every call
+        self._prompt_before, _, self._prompt_after = self._prompt_prefix.partition("{command}")
+
+        # Compiled validator for the model's structured output; orjson plus
+        # fastjsonschema replace the interpreted markdown-fence parsing and
+        # give deterministic errors on malformed replies
+        self._json_re = re.compile(r"\{.*\}", re.DOTALL)
+        self._delay_re = re.compile(r'"delay_seconds"\s*:\s*(\d+)')
+        self._validate_output = fastjsonschema.compile({
+            "type": "object",
+            "properties": {
+                "device_states": {"type": "object"},
+                "light_intensity": {
+                    "type": "object",
+                    "additionalProperties": {"type": "integer", "minimum": 0, "maximum": 100}
+                },
+                "servo_motor_angle": {"type": ["integer", "null"], "minimum": 0, "maximum": 180},
+                "servo_motor_direction": {"type": ["string", "null"]},
+                "chatbot_message": {"type": "string"},
+                "delay_seconds": {"type": "integer"}
+            },
+            "required": ["device_states"]
+        })
+
+        # Micro-batching queue: commands arriving within the batch window are
+        # coalesced into a single Groq call so concurrent requests share one
+        # network round trip and one copy of the system prompt
+        self._batch_queue = queue.Queue()
+        # Window is env-tunable: raise it on busy multi-user setups to
+        # coalesce more aggressively, lower it to shave p50 latency
+        self._batch_window = float(os.environ.get("BATCH_WINDOW_MS", "30")) / 1000.0
+        self._batch_max = 8
+        threading.Thread(target=self._batch_worker, daemon=True).start()
+
+        # LRU cache of parsed outputs so exact-repeat commands ("good
+        # night", "turn off the lights") skip the Groq call entirely. Keyed
+        # on the prompt prefix too, so template edits invalidate it.
+        self._parse_cache = collections.OrderedDict()
+        self._parse_cache_max = 512
+        self.cache_stats = {"hits": 0, "misses": 0}
+
+        # Semantic cache: catches paraphrases the exact-match cache
+        # misses ("please turn off the light in room 1"). Nearest cached
+        # command by cosine similarity wins if it clears the threshold.
+        # Bounded like the exact-match cache: a preallocated ring buffer
+        # of embeddings, overwriting the oldest entry once full.
+        self._embedder = None
+        self._sem_embs = None       # (_sem_max, 384) ring of unit-norm embeddings
+        self._sem_parses = []       # cached parse per filled row of _sem_embs
+        self._sem_next = 0          # next ring slot to write
+        self._sem_max = self._parse_cache_max
+        self._sem_threshold = 0.92
+        if SentenceTransformer is not None and os.environ.get("SEMANTIC_CACHE"):
+            try:
+                self._embedder = SentenceTransformer("all-MiniLM-L6-v2")
+            except Exception as e:
+                log.warning("Semantic cache disabled: %s", e)
+
+        # pyserial is not thread-safe, so serialize port access across the
+        # Flask worker threads and the delayed-send timers
+        self._serial_lock = threading.Lock()
+
+        # One shared pool for serial sends and a single scheduler thread for
+        # delayed sends, instead of spawning a fresh Thread or Timer per
+        # request. The delayfunc waits on an event that schedule_send sets,
+        # so a newly entered event with a shorter delay interrupts the wait
+        # for the current head instead of firing after it.
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="serial")
+        self._sched_wakeup = threading.Event()
+        self._sched = sched.scheduler(time.monotonic, self._sched_wait)
+        threading.Thread(target=self._run_scheduler, daemon=True).start()
+
+        # Precompiled fast-path grammar: most commands are simple on/off,
+        # intensity or servo requests, which can be parsed locally in
+        # microseconds instead of paying a Groq round trip. The patterns
+        # are matched against the whole clause (fullmatch, with only a
+        # politeness prefix allowed) so negations ("don't turn on ...")
+        # or trailing qualifiers ("... after 10 seconds") never match and
+        # fall through to the LLM instead of being mis-executed.
+        self._onoff_re = re.compile(
+            r"(?:please\s+)?(?:turn|switch)\s+(on|off)\s+(?:the\s+)?"
+            r"(room\s*\d+\s*(?:light|fan)|kitchen\s*(?:light|fan)|tv|refrigerator|dc\s*motor)",
+            re.I
+        )
+        self._intensity_re = re.compile(
+            r"(?:please\s+)?set\s+(room\s*\d+\s*light)\s+(?:to\s+)?(\d+)\s*%?",
+            re.I
+        )
+        self._servo_re = re.compile(
+            r"(?:please\s+)?rotate\s+(?:the\s+)?servo(?:\s+motor)?\s+(?:by\s+)?(\d+)"
+            r"\s*(?:degrees?)?\s*(clockwise|anti[\s-]?clockwise)?",
+            re.I
+        )
+        # Conjunction splitting plus bare device names let the fast path
+        # take multi-device commands like "turn on room 1 light and the
+        # kitchen fan" without falling back to the LLM
+        self._conj_re = re.compile(r"\s+and\s+|\s*,\s*", re.I)
+        self._bare_device_re = re.compile(
+            r"^(?:the\s+)?"
+            r"(room\s*\d+\s*(?:light|fan)|kitchen\s*(?:light|fan)|tv|refrigerator|dc\s*motor)$",
+            re.I
+        )
+        # Map normalized spellings back to the canonical device names
+        self._device_aliases = {
+            re.sub(r"\s+", " ", name.lower()): name for name in self.device_states
+        }
+
+    def _build_prompt(self, command: str) -> str:
+        """Assemble the per-request prompt with a single concatenation"""
+        return self._prompt_before + command + self._prompt_after
+
+    def _batch_worker(self):
+        """Coalesce queued commands into one LLM call and resolve their futures"""
+        while True:
+            batch = [self._batch_queue.get()]
+            deadline = time.time() + self._batch_window
+            while len(batch) < self._batch_max:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                if len(batch) == 1:
+                    result = self._collect_stream(self._build_prompt(batch[0][0]))
+                    batch[0][1].set_result(self._parse_structured(result))
+                else:
+                    numbered = "\n".join(f"{i+1}. {cmd}" for i, (cmd, _) in enumerate(batch))
+                    prompt = self._build_prompt(numbered)
+                    prompt += (
+                        f"\n\nThe input contains {len(batch)} numbered commands. "
+                        "Return a JSON object with a single key 'results' holding "
+                        "an array with one output object per command, in order."
+                    )
+                    result = self.llm._call(
+                        prompt,
+                        response_format={"type": "json_object"},
+                        temperature=0,
+                        max_tokens=128 * len(batch),
+                    )
+                    outputs = self._split_batch_result(result, len(batch))
+                    for (_, future), parsed in zip(batch, outputs):
+                        future.set_result(parsed)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _try_early_device_states(self, buf: str) -> Dict[str, Any]:
+        """Extract the device_states object from a partial reply, or None"""
+        idx = buf.find('"device_states"')
+        if idx == -1:
+            return None
+        start = buf.find('{', idx)
+        if start == -1:
+            return None
+        depth = 0
+        for i in range(start, len(buf)):
+            if buf[i] == '{':
+                depth += 1
+            elif buf[i] == '}':
+                depth -= 1
+                if depth == 0:
+                    try:
+                        return _json.loads(buf[start:i + 1])
+                    except ValueError:
+                        return None
+        return None
+
+    def _collect_stream(self, prompt: str) -> str:
+        """
+        Accumulate a streamed Groq reply. The prompt asks for
+        delay_seconds first, so once a zero delay and a complete
+        device_states object are both in the buffer the serial send can
+        start immediately, overlapping actuation with the tail of the
+        generation. A non-zero or not-yet-seen delay disables the early
+        dispatch: delayed commands must go through the route's
+        schedule_send, and a fragment that fails validation is left to
+        the full parse so hardware never actuates on a reply that is
+        later rejected. Stops consuming the moment the top-level object
+        closes - the decode budget is capped server-side too, but an
+        early exit here saves the tail tokens whenever the model would
+        keep talking.
+        """
+        buf = ""
+        dispatched = False
+        for delta in self.llm._stream(prompt,
+                                      response_format={"type": "json_object"},
+                                      temperature=0,
+                                      max_tokens=256):
+            buf += delta
+            if not dispatched:
+                delay_m = self._delay_re.search(buf)
+                if delay_m is not None:
+                    if delay_m.group(1) != "0":
+                        # Delayed command: actuation belongs to the
+                        # scheduler, never to the stream
+                        dispatched = True
+                    else:
+                        early = self._try_early_device_states(buf)
+                        if early is not None:
+                            dispatched = True
+                            try:
+                                self._validate_output({"device_states": early})
+                            except Exception:
+                                # Malformed fragment: the full parse will
+                                # reject the reply with no devices touched
+                                pass
+                            else:
+                                self._update_device_states(self._expand_keys(early))
+                                dirty = self.pop_dirty()
+                                if dirty:
+                                    self.submit_send(dirty)
+            # Balanced braces mean the reply object is complete
+            if buf.endswith('}') and buf.count('{') == buf.count('}'):
+                break
+        return buf
+
+    def _parse_structured(self, result: str) -> Dict[str, Any]:
+        """Extract, parse and validate the model's JSON reply"""
+        m = self._json_re.search(result)
+        if m is None:
+            raise ValueError(f"No JSON object in model reply: {result!r}")
+        data = _json.loads(m.group(0))
+        self._validate_output(data)
+        return data
+
+    def _split_batch_result(self, result: str, batch_size: int) -> list:
+        """Parse a batched LLM reply into one output dict per sub-command"""
+        cleaned = result.strip()
+        if cleaned.startswith("```"):
+            cleaned = cleaned.strip("`")
+            if cleaned.startswith("json"):
+                cleaned = cleaned[len("json"):]
+        outputs = _json.loads(cleaned)
+        if isinstance(outputs, dict):
+            outputs = outputs.get("results", [outputs])
+        for output in outputs:
+            self._validate_output(output)
+        # Pad with empty outputs if the model returned fewer items than asked
+        outputs += [{}] * (batch_size - len(outputs))
+        return outputs
+
+    def _sched_wait(self, delay):
+        """Interruptible delayfunc for the scheduler.
+
+        time.sleep cannot be cut short, so with it an event entered while
+        run() waits on an earlier, longer head event fires late. Waiting
+        on the wakeup event instead lets schedule_send break the wait and
+        have run() re-check the queue for the new head.
+        """
+        self._sched_wakeup.wait(delay)
+        self._sched_wakeup.clear()
+
+    def _run_scheduler(self):
+        """Run delayed sends from a single scheduler thread"""
+        while True:
+            self._sched.run()
+            # Queue drained: block until the next schedule_send
+            self._sched_wakeup.wait()
+            self._sched_wakeup.clear()
+
+    def snapshot_states(self):
+        """Deep-copy the current device states for a race-free send"""
+        return copy.deepcopy(self.device_states)
+
+    def submit_send(self, dirty, force=False):
+        """Run a send on the shared pool against a snapshot of the states,
+        so later requests can't mutate what this send transmits"""
+        return self._pool.submit(self.send_device_states, dirty,
+                                 self.snapshot_states(), force)
+
+    def schedule_send(self, delay_seconds, dirty):
+        """Schedule a delayed send without spawning a Timer thread.
+
+        The snapshot is taken now: the command's state changes are already
+        applied, and the delay only postpones the transmission.
+        """
+        states = self.snapshot_states()
+        self._sched.enter(delay_seconds, 1, self._pool.submit,
+                          argument=(self.send_device_states, dirty, states))
+        # Wake the scheduler thread so run() re-checks the queue; the new
+        # event may be due sooner than the one it is currently waiting on
+        self._sched_wakeup.set()
+
+    def _wait_for_reset(self):
+        """Wait out the microcontroller reset once, off the init path"""
+        time.sleep(2)  # Allow microcontroller to reset
+        self._ser_ready.set()
+
+    def _open_serial(self):
+        """Open the configured serial port"""
+        # Short read timeout: reads are only used for the ack, which the
+        # board sends within a few ms of the frame end
+        self.ser = serial.Serial(
+            port=self._serial_port,
+            baudrate=self._baud_rate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0.05
+        )
+        try:
+            # On Linux this sets ASYNC_LOW_LATENCY, dropping the USB-serial
+            # driver's receive buffering from ~16 ms to ~1 ms, so the ack
+            # reaches us almost as soon as the board transmits it. Not
+            # supported everywhere (e.g. Windows COM ports) - best effort.
+            self.ser.set_low_latency_mode(True)
+        except (AttributeError, ValueError, NotImplementedError, IOError):
+            pass
+
+    def _reconnect(self):
+        """Reopen the serial port after a write failure, with backoff.
+
+        A USB glitch or board power cycle leaves the handle dead; rather
+        than failing every send until restart, try to reopen a few times.
+        Reopening toggles DTR and resets the microcontroller, so wait out
+        the reset before writing again.
+        """
+        for attempt in range(3):
+            try:
+                if self.ser:
+                    self.ser.close()
+                self._open_serial()
+                time.sleep(2)  # reopen resets the microcontroller
+                # The reset ran init_pins(): every output is off now, so
+                # nothing previously acknowledged still holds
+                self._last_sent.clear()
+                log.info("Reconnected to serial port: %s", self._serial_port)
+                return True
+            except serial.SerialException as e:
+                log.warning("Serial reconnect failed: %s", e)
+                time.sleep(0.5 * (2 ** attempt))
+        self.ser = None
+        return False
+
+    def _canonical_device(self, raw: str) -> str:
+        """Map a matched device spelling to its canonical name, or None"""
+        normalized = re.sub(r"(room)(\d)", r"\1 \2", raw.lower().strip())
+        normalized = re.sub(r"\s+", " ", normalized)
+        return self._device_aliases.get(normalized)
+
+    def _match_clause(self, clause: str, last_state=None):
+        """Match one clause of the fast-path grammar without touching state.
+
+        The whole clause must fit a pattern - any residual text (a
+        negation, a time qualifier, anything outside the grammar) means
+        None, and the command falls back to the LLM. Returns an action
+        tuple on a match. A bare device name ("... and the kitchen fan")
+        inherits last_state from the preceding on/off clause.
+        """
+        clause = clause.strip()
+
+        m = self._intensity_re.fullmatch(clause)
+        if m:
+            device = self._canonical_device(m.group(1))
+            if device in self._intensity_lights:
+                return ("intensity", device, min(int(m.group(2)), 100))
+
+        m = self._onoff_re.fullmatch(clause)
+        if m:
+            device = self._canonical_device(m.group(2))
+            if device in self.device_states:
+                return ("onoff", device, m.group(1).lower())
+
+        if self._has_servo:
+            m = self._servo_re.fullmatch(clause)
+            if m:
+                degrees = min(int(m.group(1)), 180)
+                direction = "anti" if m.group(2) and m.group(2).lower().startswith("anti") else "clock"
+                return ("servo", direction, degrees)
+
+        if last_state in ("on", "off"):
+            m = self._bare_device_re.match(clause)
+            if m:
+                device = self._canonical_device(m.group(1))
+                if device in self.device_states:
+                    return ("onoff", device, last_state)
+
+        return None
+
+    def _apply_action(self, action) -> str:
+        """Apply one matched action and return its message fragment"""
+        kind = action[0]
+        if kind == "intensity":
+            _, device, intensity = action
+            self.device_states[device]["intensity"] = intensity
+            self.device_states[device]["state"] = "on" if intensity > 0 else "off"
+            self._dirty.add(device)
+            return f"Set {device} to {intensity}%"
+        if kind == "onoff":
+            _, device, state = action
+            if isinstance(self.device_states[device], dict):
+                self.device_states[device]["state"] = state
+            else:
+                self.device_states[device] = state
+            self._dirty.add(device)
+            return f"Turned {state} {device}"
+        _, direction, degrees = action
+        self.device_states["Servo motor"]["degrees"] = degrees
+        self.device_states["Servo motor"]["direction"] = direction
+        self._dirty.add("Servo motor")
+        direction_word = "anticlockwise" if direction == "anti" else "clockwise"
+        return f"Rotated servo motor {degrees} degrees {direction_word}"
+
+    def parse_command_fast(self, command: str) -> Dict[str, Any]:
+        """
+        Deterministic parser for the common command grammar, including
+        conjunctions ("turn on room 1 light and the kitchen fan"). Every
+        clause must match before any is applied, so a partly-understood
+        command falls back to the LLM with the state untouched. Returns
+        the same dict shape as parse_command, or None.
+        """
+        actions = []
+        last_state = None
+        for clause in self._conj_re.split(command):
+            if not clause.strip():
+                continue
+            action = self._match_clause(clause, last_state)
+            if action is None:
+                return None
+            if action[0] == "onoff":
+                last_state = action[2]
+            actions.append(action)
+
+        if not actions:
+            return None
+
+        messages = [self._apply_action(action) for action in actions]
+        return {
+            "device_states": self.device_states,
+            "chatbot_message": "; ".join(messages),
+            "delay_seconds": 0
+        }
+
+    def _expand_keys(self, mapping: Dict[str, Any]) -> Dict[str, Any]:
+        """Translate the model's short device keys back to full names"""
+        return {self._key_map.get(key, key): value for key, value in mapping.items()}
+
+    def _update_device_states(self, device_states: Dict[str, Any]):
+        """Apply the model's device_states dict, marking dirty only what
+        actually changed"""
+        for device, state in device_states.items():
+            if device in self.device_states:
+                current = self.device_states[device]
+                if device in self._intensity_lights:
+                    # Handle intensity-controlled lights
+                    if isinstance(current, dict):
+                        if isinstance(state, dict):
+                            # If state is a dict, update both state and intensity
+                            new_state = state.get("state", current["state"])
+                            new_intensity = state.get("intensity", current["intensity"])
+                        else:
+                            # If state is a string (e.g., "on" or "off"), update only the state
+                            new_state = state
+                            new_intensity = current["intensity"]
+                        if new_state != current["state"] or new_intensity != current["intensity"]:
+                            current["state"] = new_state
+                            current["intensity"] = new_intensity
+                            self._dirty.add(device)
+                elif device == "Servo motor":
+                    # Handle servo motor
+                    if isinstance(state, dict):
+                        new_direction = state.get("direction", current["direction"])
+                        new_degrees = state.get("degrees", current["degrees"])
+                        if new_direction != current["direction"] or new_degrees != current["degrees"]:
+                            current["direction"] = new_direction
+                            current["degrees"] = new_degrees
+                            self._dirty.add(device)
+                else:
+                    # Handle simple on/off devices
+                    if current != state:
+                        self.device_states[device] = state
+                        self._dirty.add(device)
+
+    def _cache_key(self, command: str) -> str:
+        """Cache key over the normalized command; the prompt prefix is mixed
+        in so template edits invalidate old entries"""
+        normalized = command.strip().lower()
+        return hashlib.sha256(
+            f"{normalized}\n{self._prompt_prefix}".encode('utf-8')
+        ).hexdigest()
+
+    def _semantic_lookup(self, command: str):
+        """Return a cached parse for the nearest paraphrase, or None.
+
+        One matmul over the (N, 384) unit-norm embedding matrix gives
+        every cosine similarity at once; sub-millisecond up to thousands
+        of cached commands.
+        """
+        if self._embedder is None or not self._sem_parses:
+            return None
+        q = self._embedder.encode(command, normalize_embeddings=True)
+        sims = self._sem_embs[:len(self._sem_parses)] @ q
+        best = int(sims.argmax())
+        if sims[best] < self._sem_threshold:
+            return None
+        return copy.deepcopy(self._sem_parses[best])
+
+    def _semantic_store(self, command: str, parsed_output: Dict[str, Any]):
+        """Remember this command's embedding and parse for paraphrase hits.
+
+        Writes into a fixed-size ring: inserts are one row assignment,
+        never a full-matrix copy, and the oldest entry is evicted once
+        the ring wraps.
+        """
+        if self._embedder is None:
+            return
+        q = self._embedder.encode(command, normalize_embeddings=True)
+        if self._sem_embs is None:
+            self._sem_embs = np.zeros((self._sem_max, q.shape[0]), dtype=q.dtype)
+        slot = self._sem_next
+        self._sem_embs[slot] = q
+        if slot < len(self._sem_parses):
+            self._sem_parses[slot] = copy.deepcopy(parsed_output)
+        else:
+            self._sem_parses.append(copy.deepcopy(parsed_output))
+        self._sem_next = (slot + 1) % self._sem_max
+
+    def parse_command(self, command: str) -> Dict[str, Any]:
+        try:
+            cache_key = self._cache_key(command)
+            cached = self._parse_cache.get(cache_key)
+            if cached is not None:
+                self.cache_stats["hits"] += 1
+                self._parse_cache.move_to_end(cache_key)
+                # Deep copy so the state updates below can't poison the cache
+                parsed_output = copy.deepcopy(cached)
+            else:
+                parsed_output = self._semantic_lookup(command)
+                if parsed_output is not None:
+                    self.cache_stats["hits"] += 1
+                else:
+                    self.cache_stats["misses"] += 1
+                    future = Future()
+                    self._batch_queue.put((command, future))
+                    parsed_output = future.result()
+                    self._parse_cache[cache_key] = copy.deepcopy(parsed_output)
+                    if len(self._parse_cache) > self._parse_cache_max:
+                        self._parse_cache.popitem(last=False)
+                    self._semantic_store(command, parsed_output)
+
+            # Update device states from parsed output
+            device_states = self._expand_keys(parsed_output.get("device_states", {}))
+            light_intensity = self._expand_keys(parsed_output.get("light_intensity", {}))
+            servo_motor_angle = parsed_output.get("servo_motor_angle", None)
+            servo_motor_direction = parsed_output.get("servo_motor_direction", None)
+
+            self._update_device_states(device_states)
+
+            # Update light intensities if provided. The output schema
+            # enforces integers here, so there is no string cleanup to do.
+            for light, intensity in light_intensity.items():
+                if light in self._intensity_lights:
+                    # If intensity is being set, ensure the light is on
+                    light_state = "on" if intensity > 0 else "off"
+                    current = self.device_states[light]
+                    if current["intensity"] != intensity or current["state"] != light_state:
+                        current["intensity"] = intensity
+                        current["state"] = light_state
+                        self._dirty.add(light)
+
+            # Update servo motor properties if provided
+            if self._has_servo:
+                servo = self.device_states["Servo motor"]
+                if servo_motor_angle is not None and servo["degrees"] != servo_motor_angle:
+                    servo["degrees"] = servo_motor_angle
+                    self._dirty.add("Servo motor")
+
+                if servo_motor_direction is not None and servo["direction"] != servo_motor_direction:
+                    servo["direction"] = servo_motor_direction
+                    self._dirty.add("Servo motor")
+
+            return {
+                "device_states": self.device_states,
+                "chatbot_message": parsed_output.get("chatbot_message", "Command processed"),
+                "delay_seconds": int(parsed_output.get("delay_seconds", 0))
+            }
+
+        except Exception as e:
+            log.error("Command parsing error: %s", e)
+            return None
+
+    def _build_row_encoders(self):
+        """Generate one specialized row encoder per device with exec.
+
+        Each encoder is a straight f-string over the current states dict,
+        hardcoding the device name and value layout, so the send path pays
+        neither isinstance dispatch nor key-layout branching.
+        """
+        lines = ["encoders = {}"]
+        for dev, state in self.device_states.items():
+            if isinstance(state, dict):
+                if dev == "Servo motor":
+                    expr = (f'lambda states: f"{dev},'
+                            f'{{states[{dev!r}][\'direction\']}},'
+                            f'{{states[{dev!r}][\'degrees\']}}"')
+                else:
+                    expr = (f'lambda states: f"{dev},'
+                            f'{{states[{dev!r}][\'state\']}},'
+                            f'{{states[{dev!r}][\'intensity\']}}"')
+            else:
+                expr = f'lambda states: f"{dev},{{states[{dev!r}]}}"'
+            lines.append(f"encoders[{dev!r}] = {expr}")
+        namespace = {}
+        exec("\n".join(lines), {}, namespace)
+        self._row_encoders = namespace["encoders"]
+
+    def _encode_row(self, dev, states) -> str:
+        """Format one device row; values are comma-free tokens, so plain
+        f-strings replace the csv module here"""
+        encoder = self._row_encoders.get(dev)
+        if encoder is not None:
+            return encoder(states)
+        # Fallback for devices injected at runtime via /command
+        state = states[dev]
+        if isinstance(state, dict):
+            if dev == "Servo motor":
+                return f"{dev},{state['direction']},{state['degrees']}"
+            return f"{dev},{state['state']},{state['intensity']}"
+        return f"{dev},{state}"
+
+    def _encode_binary_frame(self, dirty, states):
+        """Encode dirty scalar devices as 0xAA <len> (<id> <state>)* 0x55.
+
+        Two bytes per device against ~25 for a text row. Returns None if
+        any dirty device carries a structured value or an unknown name;
+        the caller falls back to text framing.
+        """
+        pairs = bytearray()
+        for dev in dirty:
+            state = states.get(dev)
+            if not isinstance(state, str) or dev not in self._dev_ids:
+                return None
+            pairs.append(self._dev_ids[dev])
+            pairs.append(1 if state == "on" else 0)
+        return bytes((0xAA, len(dirty))) + bytes(pairs) + b"\x55"
+
+    def pop_dirty(self):
+        """Take a snapshot of the devices changed since the last send.
+
+        Callers pass the snapshot to send_device_states so a delayed send
+        doesn't race with the dirty set of the next request.
+        """
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def send_device_states(self, dirty=None, states=None, force=False):
+        """
+        Send the changed device states to the microcontroller in one frame.
+
+        Works entirely off the passed snapshot, so concurrent requests
+        mutating self.device_states can't tear the rows mid-send. With
+        force=True every device is retransmitted regardless of the delta
+        tracking, e.g. to resync a board after a power cycle.
+        """
+        try:
+            if states is None:
+                states = self.snapshot_states()
+            if force:
+                dirty = set(states)
+            elif dirty is None:
+                dirty = self.pop_dirty()
+
+            # Drop devices whose value already matches what the board last
+            # acknowledged (a toggle on and back off within one batch
+            # window nets out to nothing on the wire)
+            if not force:
+                dirty = {dev for dev in dirty
+                         if states.get(dev) != self._last_sent.get(dev, _UNSENT)}
+            if not dirty:
+                # Nothing changed since the last send
+                return True
+
+            # Encode the frame up front, outside the serial lock; it reads
+            # just the snapshot. Binary framing applies when enabled and
+            # every dirty device is a plain on/off scalar.
+            frame = None
+            if self._binary_protocol:
+                frame = self._encode_binary_frame(dirty, states)
+            if frame is None:
+                # Re-encode only the rows whose value changed since the
+                # last send, then write them back-to-back in one frame;
+                # the UART paces the bytes itself, so there is no need to
+                # sleep between rows. The microcontroller parses the whole
+                # frame and replies with a single ALL_OK acknowledgment.
+                for dev in dirty:
+                    self._encoded_cache[dev] = self._encode_row(dev, states)
+                rows = [self._encoded_cache[dev] for dev in self._device_names
+                        if dev in dirty]
+                # Device names and states are fixed ASCII, so encode just
+                # the joined rows; the frame markers are pre-encoded
+                # module constants
+                frame = _FRAME_START + "\n".join(rows).encode('ascii') + _FRAME_END
+
+            # Only blocks the very first send, while the microcontroller
+            # finishes its power-on reset
+            self._ser_ready.wait(timeout=3)
+
+            reconnected = False
+            with self._serial_lock:
+                try:
+                    self.ser.write(frame)
+                except serial.SerialException:
+                    # Dead handle (USB glitch, board power cycle): reopen
+                    if not self._reconnect():
+                        raise
+                    reconnected = True
+                else:
+                    self.wait_for_ack()
+
+            if reconnected:
+                # The reopen reset the board to all-off, so the failed
+                # delta frame is no longer enough: retransmit the whole
+                # snapshot (outside the lock - it is not reentrant)
+                return self.send_device_states(states=states, force=True)
+
+            # The snapshot is private to this send, so its values can be
+            # kept by reference
+            for dev in dirty:
+                self._last_sent[dev] = states[dev]
+
+            return True
+
+        except Exception as e:
+            log.error("Error sending device states: %s", e)
+            # _last_sent was not updated, so the failed rows stay part of
+            # the delta and go out with the next send
+            self._dirty.update(dirty or ())
+            return False
+
+    def wait_for_ack(self, timeout=0.2):
+        """Wait for the microcontroller's batch acknowledgment.
+
+        Blocks in the driver on read_until instead of spinning on
+        in_waiting, so waiting costs no CPU and the ack is picked up the
+        moment the driver has it. The firmware acks within a few ms of
+        the frame end, so the window is short; a missed ack is logged
+        and the send proceeds rather than stalling the worker.
+        """
+        try:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                line = self.ser.read_until(b'\n')
+                if not line:
+                    continue  # read timed out; retry until the deadline
+                response = line.decode('utf-8').strip()
+                log.debug("Received: %s", response)
+                if response == "ALL_OK":
+                    return True
+            log.warning("No acknowledgment within %.0f ms; proceeding", timeout * 1000)
+        except Exception as e:
+            log.error("Error waiting for acknowledgment: %s", e)
+        return False
+
+    def close(self):
+        """Close serial connection, the HTTP pool and the send pool"""
+        self._pool.shutdown(wait=False)
+        # Shutdown path: tear down the process-wide Groq connection pool
+        # so the TLS sessions don't linger past the controller
+        close_shared_clients()
+        if self.ser:
+            self.ser.close()
+            log.info("Serial connection closed")
+
+
+def create_flask_app(controller):
+    """
+    Create Flask application with voice command and direct command endpoints
+    """
+    app = Flask(__name__)
+
+    # Static error payloads, serialized once; the error branches wrap the
+    # cached bytes in a response instead of re-running jsonify per hit
+    _ERR_NO_COMMAND = b'{"status":"error","message":"No command received"}'
+    _ERR_PARSE = b'{"status":"error","message":"Unable to parse command"}'
+
+    def _static_error(payload):
+        return app.response_class(payload, mimetype='application/json')
+
+    @app.route('/voice-command', methods=['POST'])
+    def receive_voice_command():
+        command = request.form.get('command', '')
+        if not command:
+            return _static_error(_ERR_NO_COMMAND)
+
+        # Try the local grammar first; only ambiguous commands pay the
+        # Groq round trip
+        parsed_result = controller.parse_command_fast(command)
+        if parsed_result is None:
+            parsed_result = controller.parse_command(command)
+        if not parsed_result:
+            return _static_error(_ERR_PARSE)
+
+        # Snapshot the dirty set now so the send doesn't race with
+        # the next request
+        dirty = controller.pop_dirty()
+        delay_seconds = int(parsed_result.get("delay_seconds", 0))
+        if delay_seconds > 0:
+            # Schedule sending device states after the delay
+            controller.schedule_send(delay_seconds, dirty)
+            log.info("Command scheduled to execute after %s seconds.", delay_seconds)
+        else:
+            # Execute immediately on the shared pool
+            controller.submit_send(dirty)
+
+        return jsonify({
+            'status': 'success',
+            'message': parsed_result['chatbot_message'],
+            'device_states': controller.device_states
+        })
+
+    @app.route('/cache-stats', methods=['GET'])
+    def cache_stats():
+        return jsonify({
+            'status': 'success',
+            'cache_stats': controller.cache_stats,
+            'entries': len(controller._parse_cache)
+        })
+
+    @app.route('/command', methods=['POST'])
+    def receive_direct_command():
+        try:
+            new_states = request.get_json()
+            if not new_states:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'No state data received'
+                }), 400
+            # Directly replace the device states; every row must be
+            # re-encoded on the next send and the cached send order
+            # rebuilt for the new table
+            controller.device_states = new_states
+            controller._device_names = tuple(new_states)
+            controller._dirty.update(new_states)
+            # Wholesale replacement is the operator's resync: nothing
+            # previously acknowledged should suppress these rows
+            controller._last_sent.clear()
+
+            # Push the full table to the Arduino, bypassing delta checks
+            controller.submit_send(controller.pop_dirty(), force=True)
+
+            return jsonify({
+                'status': 'success',
+                'message': 'Device states updated',
+                'device_states': controller.device_states
+            })
+
+        except Exception as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Error processing command: {str(e)}'
+            }), 500
+
+    return app
+
+
+def run_app(controller, host='0.0.0.0', port=5000):
+    """
+    Serve the Flask app. Production uses waitress; set FLASK_DEBUG=1 for
+    the Werkzeug debugger. The reloader stays off either way — it forks a
+    second process that would re-open the serial port and re-create the
+    Groq client.
+    """
+    app = create_flask_app(controller)
+    if os.environ.get("FLASK_DEBUG"):
+        # Debug runs show everything; production stays at INFO so
+        # log.debug calls short-circuit on the level check before any
+        # message formatting or stdout syscall happens
+        logging.basicConfig(level=logging.DEBUG)
+        app.run(host=host, port=port, debug=True, use_reloader=False, threaded=True)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        from waitress import serve
+        # Single process (the serial port is a singleton; scale via
+        # threads, not workers), thread count tunable per deployment
+        serve(app, host=host, port=port,
+              threads=int(os.environ.get("SERVER_THREADS", "8")))